@@ -1,9 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_cors import CORS
 import sys
 import os
 import logging
+from functools import lru_cache
 import numpy as np
+import orjson
+import torch
 from sentence_transformers import SentenceTransformer
 import ast
 
@@ -11,6 +14,8 @@ from config import Config
 from database.supabase_client import supabase_manager
 from database.vector_search import vector_optimizer
 from gemini_client import gemini_client
+from semantic_cache import semantic_cache
+from embedding_service import embedding_service
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,20 +27,102 @@ CORS(app)  # Enable CORS for all routes
 # Load configuration
 app.config.from_object(Config)
 
+def ojsonify(obj, status=200):
+    """Serialize obj to a JSON response with orjson (numpy arrays supported)"""
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
+
+# Prompt templates for Gemini
+PROMPT_PREFIX = 'Bạn sẽ thay mặt Đậu Đình Quang Anh để trả lời các câu hỏi của người dùng, sử dụng từ ngữ teencode 1 chút thêm cả icon'
+CONTEXT_PROMPT = PROMPT_PREFIX + '. Câu hỏi của người dùng là "{question}" và các thông tin liên quan đến câu hỏi là:\n\n{documents_text}'
+NO_CONTEXT_PROMPT = PROMPT_PREFIX + '. Câu hỏi của người dùng là "{question}" và không có thông tin liên quan nào được tìm thấy.'
+NO_MATCH_PROMPT = PROMPT_PREFIX + ', trả lời câu hỏi 1 cách thân thiện như đang đối thoại với người dùng vậy, nên nhớ chỉ trả lời các câu hỏi liên quan đến Quang Anh với mục đích giới thiệu Quang Anh(Đậu Đình Quang Anh). Câu hỏi của người dùng là "{question}" và không có thông tin liên quan nào được tìm thấy.'
+
 # Global embedding model
 embedding_model = None
 
+# Dynamically int8-quantized ONNX file written by export_onnx_model
+ONNX_QUANTIZED_FILE = 'onnx/model_qint8_avx2.onnx'
+
+def export_onnx_model(model_dir):
+    """Export the embedding model to ONNX with dynamic int8 quantization (one-time)"""
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    
+    model = SentenceTransformer(Config.EMBEDDING_MODEL_NAME, backend='onnx')
+    model.save(model_dir)
+    export_dynamic_quantized_onnx_model(model, 'avx2', model_dir)
+    logger.info(f"✅ Quantized ONNX embedding model exported to {model_dir}")
+
 def load_embedding_model():
-    """Load the Vietnamese embedding model (online only)"""
+    """Load the Vietnamese embedding model (PyTorch or ONNX int8 backend)"""
     global embedding_model
     try:
-        embedding_model = SentenceTransformer('keepitreal/vietnamese-sbert')
-        logger.info("✅ Online Vietnamese embedding model loaded successfully")
+        torch.set_num_threads(Config.TORCH_NUM_THREADS)
+        try:
+            torch.set_num_interop_threads(Config.TORCH_INTEROP_THREADS)
+        except RuntimeError:
+            # Can only be set once per process, before inter-op work starts (e.g. on reload)
+            pass
+        
+        if Config.EMBEDDING_BACKEND == 'onnx':
+            if not os.path.exists(os.path.join(Config.ONNX_MODEL_DIR, ONNX_QUANTIZED_FILE)):
+                export_onnx_model(Config.ONNX_MODEL_DIR)
+            
+            model = SentenceTransformer(
+                Config.ONNX_MODEL_DIR,
+                backend='onnx',
+                model_kwargs={'file_name': ONNX_QUANTIZED_FILE}
+            )
+            logger.info("✅ ONNX int8 Vietnamese embedding model loaded successfully")
+        else:
+            # CPU unless a GPU is requested: a CUDA context created here would not survive
+            # the fork into preloaded gunicorn workers
+            device = Config.EMBEDDING_DEVICE or 'cpu'
+            if device.startswith('cuda') and not torch.cuda.is_available():
+                logger.warning(f"⚠️ EMBEDDING_DEVICE={device} but CUDA is not available, using cpu")
+                device = 'cpu'
+            model = SentenceTransformer(Config.EMBEDDING_MODEL_NAME, device=device)
+            if device.startswith('cuda'):
+                model.half()  # FP16 halves memory traffic on tensor cores
+            logger.info(f"✅ Online Vietnamese embedding model loaded successfully on {device}")
+            
+            if Config.EMBEDDING_TORCH_COMPILE:
+                transformer = model[0]
+                eager_model = transformer.auto_model
+                try:
+                    transformer.auto_model = torch.compile(eager_model, mode='reduce-overhead', dynamic=True)
+                    model.encode('warm up')  # Compilation happens on the first call
+                    logger.info("✅ Embedding model compiled with torch.compile")
+                except Exception as e:
+                    # e.g. Inductor without a C toolchain
+                    transformer.auto_model = eager_model
+                    logger.warning(f"⚠️ torch.compile failed, using the eager model: {e}")
+        
+        # Warm up so the first real request does not pay graph/JIT setup cost
+        model.encode('warm up')
+        embedding_service.set_model(model)
+        # Published only once the model has encoded successfully
+        embedding_model = model
+        _encode_cached.cache_clear()
         return True
     except Exception as e:
         logger.error(f"❌ Failed to load embedding model: {e}")
         return False
 
+def normalize_question(question):
+    """Lowercase and collapse whitespace so verbatim repeats share a cache entry"""
+    return " ".join(question.lower().split())
+
+@lru_cache(maxsize=2048)
+def _encode_cached(text_norm: str) -> np.ndarray:
+    """Encode normalized question text, caching the embedding for repeated questions"""
+    embedding = embedding_service.encode(text_norm).astype(np.float32)
+    embedding.flags.writeable = False  # Shared between requests through the cache
+    return embedding
+
 def calculate_cosine_similarity(vec1, vec2):
     """Calculate cosine similarity between two vectors"""
     try:
@@ -50,11 +137,26 @@ def calculate_cosine_similarity(vec1, vec2):
         logger.error(f"Error calculating similarity: {e}")
         return 0.0
 
+def start_ai_response(prompt):
+    """Dispatch a Gemini request in the background (None if Gemini is unavailable)"""
+    if not gemini_client.is_available():
+        return None
+    
+    started = gemini_client.generate_response_async(prompt)
+    return started['future'] if started['success'] else None
+
 def find_nearest_matches(query_embedding, match_threshold=0.5, match_count=2):
     """Find nearest matches in database using optimized vector search"""
     try:
+        # Search server-side with pgvector when the migration is applied
+        if Config.VECTOR_SEARCH_BACKEND == 'pgvector':
+            try:
+                return supabase_manager.match_documents(query_embedding, match_threshold, match_count)
+            except Exception as e:
+                logger.warning(f"pgvector search failed, falling back to local search: {e}")
+        
         # Get all documents from database
-        documents = supabase_manager.get_chat_history(limit=1000)
+        documents = supabase_manager.get_chat_history(limit=1000, use_snapshot=True)
         
         if not documents:
             return []
@@ -76,10 +178,10 @@ def find_nearest_matches(query_embedding, match_threshold=0.5, match_count=2):
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return ojsonify({
         'status': 'healthy',
         'message': 'Chatbot API is running'
-    }), 200
+    }, 200)
 
 @app.route('/api/chat', methods=['POST'])
 def process_document():
@@ -88,9 +190,9 @@ def process_document():
         data = request.get_json()
         
         if not data or 'prompt' not in data:
-            return jsonify({
+            return ojsonify({
                 'error': 'Missing document content in request body'
-            }), 400
+            }, 400)
         
         document_content = data['prompt']
         source_name = data.get('user_id', 'unknown_source')
@@ -112,18 +214,18 @@ def process_document():
             logger.error(f"Failed to store document chunk: {e}")
             # Continue even if storage fails
         
-        return jsonify({
+        return ojsonify({
             'content': document_content,
             'status': response,
             'source': source_name,
             'timestamp': 'now'
-        }), 200
+        }, 200)
         
     except Exception as e:
         logger.error(f"Error in document processing endpoint: {e}")
-        return jsonify({
+        return ojsonify({
             'error': 'Internal server error'
-        }), 500
+        }, 500)
 
 @app.route('/api/query', methods=['POST'])
 def process_query():
@@ -132,30 +234,50 @@ def process_query():
         data = request.get_json()
         
         if not data or 'question' not in data:
-            return jsonify({
+            return ojsonify({
                 'error': 'Missing question in request body'
-            }), 400
+            }, 400)
         
         question = data['question']
         match_threshold = data.get('match_threshold', 0.5)
         match_count = data.get('match_count', 2)
         
-        # Load embedding model if not loaded
+        # Embedding model is loaded at import time
         if embedding_model is None:
-            if not load_embedding_model():
-                return jsonify({
-                    'error': 'Failed to load embedding model'
-                }), 500
+            return ojsonify({
+                'error': 'Failed to load embedding model'
+            }, 500)
         
         # Encode the question
         try:
-            question_embedding = embedding_model.encode(question).tolist()
-            logger.info(f"Question encoded successfully: {len(question_embedding)} dimensions")
+            question_embedding = _encode_cached(normalize_question(question))
+            logger.info(f"Question encoded successfully: {question_embedding.shape[0]} dimensions")
         except Exception as e:
             logger.error(f"Failed to encode question: {e}")
-            return jsonify({
+            return ojsonify({
                 'error': 'Failed to encode question'
-            }), 500
+            }, 500)
+        
+        # Serve near-duplicate questions asked with the same search parameters from the semantic cache
+        cache_key = (match_threshold, match_count)
+        cached_response = semantic_cache.get(question_embedding, cache_key)
+        if cached_response is not None:
+            response_data = dict(
+                cached_response,
+                question=question,
+                match_threshold=match_threshold,
+                match_count=match_count,
+                ai_status='cache_hit'
+            )
+            logger.info("⚡ Returning cached AI response, skipping vector search and Gemini")
+            return ojsonify(response_data, 200)
+        
+        # Optionally start the no-matches Gemini call early so it overlaps vector search,
+        # unless every executor slot is already busy
+        no_match_prompt = NO_MATCH_PROMPT.format(question=question)
+        speculative_future = None
+        if Config.GEMINI_SPECULATIVE and gemini_client.has_idle_worker():
+            speculative_future = start_ai_response(no_match_prompt)
         
         # Find nearest matches
         matches = find_nearest_matches(question_embedding, match_threshold, match_count)
@@ -163,7 +285,7 @@ def process_query():
         # Prepare response
         response_data = {
             'question': question,
-            'question_embedding_dimensions': len(question_embedding),
+            'question_embedding_dimensions': question_embedding.shape[0],
             'match_threshold': match_threshold,
             'match_count': match_count,
             'found_matches': len(matches),
@@ -171,77 +293,73 @@ def process_query():
         }
         
         if matches:
-            # Get unique original_data to avoid duplicates
-            unique_original_data = []
-            seen_original_data = set()
+            # The speculative no-matches answer is not needed
+            if speculative_future is not None:
+                speculative_future.cancel()
             
-            for match in matches:
-                original_data = match.get('original_data', '')
-                if original_data and original_data not in seen_original_data:
-                    unique_original_data.append(original_data)
-                    seen_original_data.add(original_data)
+            # Get unique original_data to avoid duplicates
+            unique_original_data = list(dict.fromkeys(
+                match.get('original_data', '') for match in matches if match.get('original_data')
+            ))
             
-            # Create documents text with unique original_data
+            # Create prompt with unique original_data
             if unique_original_data:
-                documents_text = '\n\n'.join([
+                documents_text = '\n\n'.join(
                     f"Tài liệu {i+1}: {original_data}"
                     for i, original_data in enumerate(unique_original_data)
-                ])
-                
-                # Create prompt in the requested format
-                combined_content = f'Bạn sẽ thay mặt Đậu Đình Quang Anh để trả lời các câu hỏi của người dùng, sử dụng từ ngữ teencode 1 chút thêm cả icon. Câu hỏi của người dùng là "{question}" và các thông tin liên quan đến câu hỏi là:\n\n{documents_text}'
+                )
+                prompt = CONTEXT_PROMPT.format(question=question, documents_text=documents_text)
             else:
-                combined_content = f'Bạn sẽ thay mặt Đậu Đình Quang Anh để trả lời các câu hỏi của người dùng, sử dụng từ ngữ teencode 1 chút thêm cả icon. Câu hỏi của người dùng là "{question}" và không có thông tin liên quan nào được tìm thấy.'
+                prompt = NO_CONTEXT_PROMPT.format(question=question)
             
-            response_data['combined_content'] = combined_content
             response_data['status'] = 'success'
             response_data['unique_original_data_count'] = len(unique_original_data)
-            
-            # Generate AI response using Gemini
-            if gemini_client.is_available():
-                logger.info("🤖 Generating AI response with Gemini...")
-                ai_response = gemini_client.generate_response(combined_content)
-                
-                if ai_response['success']:
-                    response_data['ai_response'] = ai_response['response']
-                    response_data['ai_status'] = 'success'
-                    logger.info("✅ AI response generated successfully")
-                else:
-                    response_data['ai_response'] = None
-                    response_data['ai_status'] = 'failed'
-                    response_data['ai_error'] = ai_response['error']
-                    logger.warning(f"⚠️ AI response generation failed: {ai_response['error']}")
-            else:
-                response_data['ai_response'] = None
-                response_data['ai_status'] = 'unavailable'
-                logger.info("ℹ️ Gemini AI not available, skipping AI response")
+            ai_future = start_ai_response(prompt)
         else:
-            response_data['combined_content'] = f'Bạn sẽ thay mặt Đậu Đình Quang Anh để trả lời các câu hỏi của người dùng, sử dụng từ ngữ teencode 1 chút thêm cả icon, trả lời câu hỏi 1 cách thân thiện như đang đối thoại với người dùng vậy, nên nhớ chỉ trả lời các câu hỏi liên quan đến Quang Anh với mục đích giới thiệu Quang Anh(Đậu Đình Quang Anh). Câu hỏi của người dùng là "{question}" và không có thông tin liên quan nào được tìm thấy.'
+            prompt = no_match_prompt
             response_data['status'] = 'no_matches'
+            ai_future = speculative_future or start_ai_response(prompt)
+        
+        response_data['combined_content'] = prompt
+        
+        # Collect the AI response from Gemini
+        if ai_future is not None:
+            logger.info("🤖 Waiting for AI response from Gemini...")
+            ai_response = gemini_client.get_async_result(ai_future, timeout=gemini_client.timeout)
             
-            # Generate AI response for no matches case
-            if gemini_client.is_available():
-                logger.info("🤖 Generating AI response for no matches case...")
-                ai_response = gemini_client.generate_response(response_data['combined_content'])
-                
-                if ai_response['success']:
-                    response_data['ai_response'] = ai_response['response']
-                    response_data['ai_status'] = 'success'
-                else:
-                    response_data['ai_response'] = None
-                    response_data['ai_status'] = 'failed'
-                    response_data['ai_error'] = ai_response['error']
+            if ai_response['success']:
+                response_data['ai_response'] = ai_response['response']
+                response_data['ai_status'] = 'success'
+                logger.info("✅ AI response generated successfully")
             else:
                 response_data['ai_response'] = None
-                response_data['ai_status'] = 'unavailable'
+                response_data['ai_status'] = 'failed'
+                response_data['ai_error'] = ai_response['error']
+                logger.warning(f"⚠️ AI response generation failed: {ai_response['error']}")
+        else:
+            response_data['ai_response'] = None
+            response_data['ai_status'] = 'unavailable'
+            logger.info("ℹ️ Gemini AI not available, skipping AI response")
         
-        return jsonify(response_data), 200
+        if response_data.get('ai_status') == 'success':
+            semantic_cache.put(question_embedding, dict(response_data), cache_key)
+        
+        return ojsonify(response_data, 200)
         
     except Exception as e:
         logger.error(f"Error in query processing endpoint: {e}")
-        return jsonify({
+        return ojsonify({
             'error': 'Internal server error'
-        }), 500
+        }, 500)
+
+# Load shared resources at import time so `gunicorn --preload` workers share them copy-on-write
+vector_optimizer.load_from_disk(Config.VECTOR_CACHE_PATH)
+
+if embedding_model is None:
+    if load_embedding_model():
+        logger.info("Embedding model loaded successfully")
+    else:
+        logger.warning("Failed to load embedding model")
 
 if __name__ == '__main__':
     try:
@@ -249,12 +367,6 @@ if __name__ == '__main__':
         Config.validate_config()
         logger.info("Configuration validated successfully")
         
-        # Load embedding model
-        if load_embedding_model():
-            logger.info("Embedding model loaded successfully")
-        else:
-            logger.warning("Failed to load embedding model")
-        
         # Test Supabase connection
         if supabase_manager.test_connection():
             logger.info("Supabase connection test successful")
@@ -19,12 +19,43 @@ class Config:
     API_HOST = os.getenv('API_HOST', '0.0.0.0')
     API_PORT = int(os.getenv('API_PORT', 5000))
     
+    # Embedding Model Configuration ('torch' or 'onnx')
+    EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'keepitreal/vietnamese-sbert')
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+    EMBEDDING_DEVICE = os.getenv('EMBEDDING_DEVICE')  # e.g. 'cuda' or 'cpu'; cpu when unset
+    ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', './vi-sbert-onnx-int8')
+    EMBEDDING_TORCH_COMPILE = os.getenv('EMBEDDING_TORCH_COMPILE', 'false').lower() == 'true'
+    TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', min(8, os.cpu_count() or 1)))
+    TORCH_INTEROP_THREADS = int(os.getenv('TORCH_INTEROP_THREADS', max(1, TORCH_NUM_THREADS // 2)))
+    
+    # Vector Storage Configuration ('int8' or 'float32')
+    VECTOR_STORAGE_DTYPE = os.getenv('VECTOR_STORAGE_DTYPE', 'int8')
+    
+    # Vector Search Configuration ('local' or 'pgvector')
+    VECTOR_SEARCH_BACKEND = os.getenv('VECTOR_SEARCH_BACKEND', 'local')
+    VECTOR_CACHE_PATH = os.getenv('VECTOR_CACHE_PATH', 'cache/vectors.f32')
+    
+    # Semantic Cache Configuration
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+    SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', 3600))
+    SEMANTIC_CACHE_MAX_SIZE = int(os.getenv('SEMANTIC_CACHE_MAX_SIZE', 1000))
+    
     # Gemini AI Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    # Start the no-matches answer before vector search finishes (costs an extra call on matches)
+    GEMINI_SPECULATIVE = os.getenv('GEMINI_SPECULATIVE', 'false').lower() == 'true'
+    
+    # Seconds a fetched document list is reused by vector search
+    HISTORY_SNAPSHOT_TTL = int(os.getenv('HISTORY_SNAPSHOT_TTL', 60))
+    
+    _validated = False
     
     @staticmethod
     def validate_config():
-        """Validate that all required configuration is present"""
+        """Validate that all required configuration is present (checked once per process)"""
+        if Config._validated:
+            return True
+        
         required_vars = ['SUPABASE_URL', 'SUPABASE_KEY']
         missing_vars = [var for var in required_vars if not getattr(Config, var)]
         
@@ -35,4 +66,5 @@ class Config:
         if not Config.GEMINI_API_KEY:
             print("⚠️  Warning: GEMINI_API_KEY not found. AI responses will be disabled.")
         
+        Config._validated = True
         return True 
\ No newline at end of file
@@ -0,0 +1,37 @@
+-- Server-side vector search for the Vector_database table (pgvector + HNSW)
+-- Run once in the Supabase SQL editor, then backfill with
+-- supabase_manager.backfill_embeddings() and set VECTOR_SEARCH_BACKEND=pgvector
+
+create extension if not exists vector;
+
+alter table "Vector_database" add column if not exists embedding vector(768);
+
+create index if not exists vector_database_embedding_hnsw_idx
+    on "Vector_database" using hnsw (embedding vector_cosine_ops);
+
+create or replace function match_documents(
+    query_embedding vector(768),
+    match_threshold float,
+    match_count int
+)
+returns table (
+    id bigint,
+    chunks text,
+    "Doc" text,
+    additional text,
+    similarity float
+)
+language sql stable
+as $$
+    select
+        v.id,
+        v.chunks::text,
+        v."Doc"::text,
+        v.additional::text,
+        1 - (v.embedding <=> query_embedding) as similarity
+    from "Vector_database" v
+    where v.embedding is not null
+      and 1 - (v.embedding <=> query_embedding) >= match_threshold
+    order by v.embedding <=> query_embedding
+    limit match_count;
+$$;
@@ -1,6 +1,9 @@
 from supabase import create_client, Client
 from config import Config
+from database.vector_search import vector_optimizer
+import numpy as np
 import logging
+import base64
 import time
 
 logger = logging.getLogger(__name__)
@@ -13,11 +16,19 @@ class SupabaseManager:
         try:
             Config.validate_config()
             self.client: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+            self.snapshot_ttl = Config.HISTORY_SNAPSHOT_TTL
+            self._snapshots = {}  # (limit, user_id) -> (fetched_at, rows)
             logger.info("Supabase client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Supabase client: {e}")
             raise
     
+    def reconnect(self):
+        """Re-create the Supabase client (e.g. in a forked worker process)"""
+        self.client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+        self._snapshots = {}
+        logger.info("Supabase client re-created")
+    
     def test_connection(self):
         """Test the connection to Supabase"""
         try:
@@ -36,24 +47,57 @@ class SupabaseManager:
             if link:
                 additional_info = f"link:{link}"
             
+            is_embedding = isinstance(response, (list, tuple, np.ndarray))
+            if is_embedding:
+                vector = self.encode_vector(response)
+            else:
+                vector = response if response else ""
+            
             data = {
                 'chunks': prompt,  # Store CHUNK
-                'Vector': response if response else "",  # Store vector
+                'Vector': vector,  # Store vector
                 'Doc': original_data or "",  # Store original DATA
                 'additional': additional_info  # Store link
             }
             
+            if is_embedding and Config.VECTOR_SEARCH_BACKEND == 'pgvector':
+                data['embedding'] = np.asarray(response, dtype=np.float32).tolist()  # pgvector column
+            
             result = self.client.table('Vector_database').insert(data).execute()
+            self._snapshots.clear()
             logger.info(f"Chat data inserted successfully: {result}")
             return result
         except Exception as e:
             logger.error(f"Failed to insert chat data: {e}")
             raise
     
-    def get_chat_history(self, limit: int = 50, user_id: str = None):
-        """Get chat history from Supabase using existing table structure"""
+    def encode_vector(self, vector) -> str:
+        """Encode an embedding for the Vector column (int8 + scale or raw float32, base64)"""
+        vector = np.asarray(vector, dtype=np.float32)
+        
+        if Config.VECTOR_STORAGE_DTYPE == 'int8':
+            # Symmetric per-vector quantization: 4 bytes of float32 scale followed by int8 values
+            max_abs = float(np.max(np.abs(vector))) if vector.size else 0.0
+            scale = np.float32(max_abs / 127 if max_abs > 0 else 1.0)
+            quantized = np.round(vector / scale).astype(np.int8)
+            return 'i8:' + base64.b64encode(scale.tobytes() + quantized.tobytes()).decode('ascii')
+        
+        return base64.b64encode(vector.tobytes()).decode('ascii')
+    
+    def get_chat_history(self, limit: int = 50, user_id: str = None, use_snapshot: bool = False):
+        """Get chat history from Supabase using existing table structure
+        
+        With use_snapshot, a result fetched within the last snapshot_ttl seconds
+        is returned without another round-trip.
+        """
+        key = (limit, user_id)
+        if use_snapshot:
+            snapshot = self._snapshots.get(key)
+            if snapshot and time.time() - snapshot[0] < self.snapshot_ttl:
+                return snapshot[1]
+        
         try:
-            query = self.client.table('Vector_database').select('*')
+            query = self.client.table('Vector_database').select('id, chunks, Vector, Doc, additional')
             
             if user_id:
                 query = query.eq('Doc', user_id)
@@ -63,29 +107,80 @@ class SupabaseManager:
             # Transform data to match expected format
             transformed_data = []
             for item in result.data:
-                additional = item.get('additional', '')
-                
-                # Parse additional field for link only
-                link = ""
-                if isinstance(additional, str):
-                    if additional.startswith('link:'):
-                        # Support both 'link:<url>' and legacy 'link: <url>' formats
-                        link = additional.replace('link: ', '').replace('link:', '', 1)
-                        link = link.strip()
-                
                 transformed_data.append({
                     'id': item.get('id'),
                     'chunk': item.get('chunks'),  # CHUNK
                     'vector': item.get('Vector'),  # Vector
                     'original_data': item.get('Doc'),  # Original DATA
-                    'link': link  # Link
+                    'link': self._parse_link(item.get('additional', ''))  # Link
                 })
             
+            self._snapshots[key] = (time.time(), transformed_data)
             return transformed_data
         except Exception as e:
             logger.error(f"Failed to get chat history: {e}")
             raise
     
+    def match_documents(self, query_embedding, match_threshold: float = 0.5, match_count: int = 2):
+        """Find nearest documents server-side via the pgvector match_documents RPC"""
+        try:
+            result = self.client.rpc('match_documents', {
+                'query_embedding': np.asarray(query_embedding, dtype=np.float32).tolist(),
+                'match_threshold': match_threshold,
+                'match_count': match_count
+            }).execute()
+            
+            return [{
+                'id': item.get('id'),
+                'chunk': item.get('chunks', ''),
+                'original_data': item.get('Doc', ''),
+                'link': self._parse_link(item.get('additional', '')),
+                'similarity': float(item.get('similarity', 0.0))
+            } for item in result.data]
+        except Exception as e:
+            logger.error(f"Failed to match documents: {e}")
+            raise
+    
+    def backfill_embeddings(self, batch_size: int = 500):
+        """One-time copy of the Vector column into the pgvector embedding column"""
+        updated = 0
+        last_id = 0
+        while True:
+            result = self.client.table('Vector_database').select('id, Vector') \
+                .is_('embedding', 'null').gt('id', last_id) \
+                .order('id').limit(batch_size).execute()
+            
+            if not result.data:
+                break
+            
+            for item in result.data:
+                last_id = item.get('id')
+                vector = item.get('Vector')
+                if not vector or vector == 'processed':
+                    continue
+                
+                parsed = vector_optimizer.parse_vector(vector, last_id)
+                if len(parsed) == 0:
+                    continue
+                
+                self.client.table('Vector_database').update({'embedding': parsed.tolist()}) \
+                    .eq('id', last_id).execute()
+                updated += 1
+        
+        logger.info(f"Backfilled embeddings for {updated} rows")
+        return updated
+    
+    @staticmethod
+    def _parse_link(additional) -> str:
+        """Parse additional field for link only"""
+        link = ""
+        if isinstance(additional, str):
+            if additional.startswith('link:'):
+                # Support both 'link:<url>' and legacy 'link: <url>' formats
+                link = additional.replace('link: ', '').replace('link:', '', 1)
+                link = link.strip()
+        return link
+    
     def create_tables(self):
         """Create necessary tables if they don't exist"""
         # Note: Using existing table structure from user's Supabase database
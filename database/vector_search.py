@@ -6,11 +6,18 @@ Implements caching, indexing, and efficient similarity search
 
 import numpy as np
 import ast
+import base64
+import hashlib
+import json
 import logging
+import os
+import tempfile
+import threading
 from typing import List, Dict, Tuple
 from functools import lru_cache
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from database.vector_search_kernels import cosine_scores
 
 logger = logging.getLogger(__name__)
 
@@ -18,48 +25,225 @@ class VectorSearchOptimizer:
     """Optimized vector search with caching and indexing"""
     
     def __init__(self):
-        self.vector_cache = {}  # Cache for parsed vectors
+        self.vector_cache = OrderedDict()  # LRU cache for parsed vectors, keyed by row id
+        self.vector_cache_size = 10_000  # Max parsed vectors kept in memory
         self.similarity_cache = {}  # Cache for similarity calculations
         self.documents_cache = None
         self.last_cache_update = 0
         self.cache_ttl = 300  # 5 minutes cache TTL
+        # (matrix, doc_index, key): (N, d) float32 matrix of L2-normalized document vectors,
+        # metadata aligned with its rows and the document ids it was built from. Replaced as
+        # one tuple so a concurrent search never pairs one matrix with another's rows.
+        self.index = None
+        self.index_lock = threading.Lock()  # Serializes matrix rebuilds
+        self.save_lock = threading.Lock()  # Serializes background saves
+        self.persist_path = None  # Where rebuilt matrices are saved (set by load_from_disk)
         
-    def parse_vector(self, vector_str: str) -> np.ndarray:
-        """Parse vector string to numpy array with caching"""
-        if vector_str in self.vector_cache:
-            return self.vector_cache[vector_str]
+    def parse_vector(self, vector_str: str, doc_id=None) -> np.ndarray:
+        """Parse stored vector to a unit-length numpy array with caching (keyed by row id when given)"""
+        cache_key = doc_id if doc_id is not None else vector_str
+        if cache_key in self.vector_cache:
+            self.vector_cache.move_to_end(cache_key)
+            return self.vector_cache[cache_key]
         
         try:
             if isinstance(vector_str, str):
-                vector_list = ast.literal_eval(vector_str)
-                vector_array = np.array(vector_list, dtype=np.float32)
+                if vector_str.lstrip().startswith('['):
+                    # Legacy rows store the vector as a Python list literal
+                    vector_list = ast.literal_eval(vector_str)
+                    vector_array = np.array(vector_list, dtype=np.float32)
+                elif vector_str.startswith('i8:'):
+                    # Base64-encoded float32 scale followed by int8 values
+                    raw = base64.b64decode(vector_str[3:])
+                    scale = np.frombuffer(raw[:4], dtype=np.float32)[0]
+                    vector_array = np.frombuffer(raw[4:], dtype=np.int8).astype(np.float32) * scale
+                else:
+                    # Base64-encoded raw float32 bytes
+                    vector_array = np.frombuffer(base64.b64decode(vector_str), dtype=np.float32)
             else:
                 vector_array = np.array(vector_str, dtype=np.float32)
             
-            self.vector_cache[vector_str] = vector_array
+            # Normalize once so similarity against it is a bare dot product
+            norm = np.linalg.norm(vector_array)
+            if norm > 0:
+                vector_array = (vector_array / norm).astype(np.float32)
+            
+            self.vector_cache[cache_key] = vector_array
+            if len(self.vector_cache) > self.vector_cache_size:
+                self.vector_cache.popitem(last=False)
             return vector_array
         except Exception as e:
             logger.error(f"Error parsing vector: {e}")
             return np.array([])
     
     def calculate_cosine_similarity_optimized(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
-        """Optimized cosine similarity calculation"""
+        """Cosine similarity of two unit-length vectors"""
         try:
-            # Use numpy's optimized dot product
-            dot_product = np.dot(vec1, vec2)
-            norm1 = np.linalg.norm(vec1)
-            norm2 = np.linalg.norm(vec2)
-            
-            if norm1 == 0 or norm2 == 0:
-                return 0.0
-                
-            similarity = dot_product / (norm1 * norm2)
-            return float(similarity)
+            return float(np.vdot(vec1, vec2))
         except Exception as e:
             logger.error(f"Error calculating similarity: {e}")
             return 0.0
     
-    def batch_similarity_search(self, query_embedding: List[float], 
+    def build_matrix(self, documents: List[Dict]):
+        """Return the (matrix, doc_index, key) index for documents, rebuilding it if they changed"""
+        key = tuple(doc.get('id') for doc in documents)
+        index = self.index
+        if index is not None and index[2] == key:
+            return index
+        
+        with self.index_lock:
+            # Another request may have rebuilt the matrix while this one waited
+            index = self.index
+            if index is not None and index[2] == key:
+                return index
+            return self._rebuild_matrix(documents, key)
+    
+    def _rebuild_matrix(self, documents: List[Dict], key: tuple):
+        """Stack document vectors into a contiguous, row-normalized matrix (caller holds index_lock)"""
+        rows = []
+        doc_index = []
+        for doc in documents:
+            doc_vector = self.parse_vector(doc.get('vector', ''), doc.get('id'))
+            
+            if len(doc_vector) == 0:
+                continue
+            
+            if rows and len(doc_vector) != len(rows[0]):
+                logger.warning(f"Vector dimension mismatch for document {doc.get('id')}, skipping matrix build")
+                return None
+            
+            rows.append(doc_vector)
+            doc_index.append({
+                'id': doc.get('id'),
+                'chunk': doc.get('chunk', ''),
+                'original_data': doc.get('original_data', ''),
+                'link': doc.get('link', '')
+            })
+        
+        if not rows:
+            return None
+        
+        # Rows are already unit length, so a query only needs a single matrix-vector product
+        matrix = np.vstack(rows).astype(np.float32)
+        
+        index = (matrix, doc_index, key)
+        self.index = index
+        logger.info(f"Vector matrix built with shape {matrix.shape}")
+        
+        if self.persist_path:
+            # Persist in the background so the rebuilding request is not held up by disk I/O
+            threading.Thread(target=self.save_to_disk, args=(self.persist_path, index), daemon=True).start()
+        return index
+    
+    def _write_temp(self, directory: str, write) -> str:
+        """Write a file under a per-process temp name in directory and return its path"""
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.vectors-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            return tmp_path
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    
+    def _fingerprint(self, matrix: np.ndarray) -> str:
+        """Cheap checksum of the first and last rows (reads two pages, not the whole matrix)"""
+        if len(matrix) == 0:
+            return ''
+        return hashlib.blake2b(matrix[0].tobytes() + matrix[-1].tobytes()).hexdigest()
+    
+    def save_to_disk(self, path: str, index=None) -> bool:
+        """Persist the matrix as raw float32 and its row metadata as a JSON sidecar
+        
+        The sidecar is committed last and records the matrix shape and a fingerprint,
+        so a crash or a concurrent writer between the two replaces is detected on load.
+        """
+        index = index or self.index
+        if index is None:
+            return False
+        matrix, doc_index, key = index
+        
+        with self.save_lock:
+            # A newer matrix was published while this save waited; its own save will follow
+            if self.index is not None and self.index is not index:
+                return False
+            return self._save_index(path, matrix, doc_index, key)
+    
+    def _save_index(self, path: str, matrix: np.ndarray, doc_index: List[Dict], key: tuple) -> bool:
+        """Write one (matrix, doc_index, key) index to path (caller holds save_lock)"""
+        tmp_paths = []
+        try:
+            directory = os.path.dirname(path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            metadata = json.dumps({
+                'shape': list(matrix.shape),
+                'nbytes': matrix.nbytes,
+                'fingerprint': self._fingerprint(matrix),
+                'matrix_key': list(key),
+                'doc_index': doc_index
+            }, ensure_ascii=False).encode('utf-8')
+            
+            matrix_tmp = self._write_temp(directory, matrix.tofile)
+            tmp_paths.append(matrix_tmp)
+            metadata_tmp = self._write_temp(directory, lambda f: f.write(metadata))
+            tmp_paths.append(metadata_tmp)
+            
+            os.replace(matrix_tmp, path)
+            os.replace(metadata_tmp, path + '.json')
+            logger.info(f"Vector matrix saved to {path}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save vector matrix: {e}")
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            return False
+    
+    def load_from_disk(self, path: str) -> bool:
+        """Memory-map a matrix saved by save_to_disk and persist future rebuilds there"""
+        self.persist_path = path
+        
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                metadata = json.load(f)
+            
+            shape = tuple(metadata['shape'])
+            rows = shape[0]
+            if len(metadata['doc_index']) != rows or len(metadata['matrix_key']) != rows:
+                raise ValueError("metadata row count does not match matrix shape")
+            
+            # A size mismatch means matrix and metadata come from different saves
+            expected_size = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+            if os.path.getsize(path) != expected_size or metadata.get('nbytes') != expected_size:
+                raise ValueError(f"matrix file size {os.path.getsize(path)} does not match shape {shape}")
+            
+            # Copy-on-write mapping: pages load lazily and the file is never modified
+            matrix = np.memmap(path, dtype=np.float32, mode='c', shape=shape)
+            if self._fingerprint(matrix) != metadata.get('fingerprint'):
+                raise ValueError("matrix fingerprint does not match metadata")
+            
+            self.index = (matrix, metadata['doc_index'], tuple(metadata['matrix_key']))
+            logger.info(f"Vector matrix loaded from {path} with shape {matrix.shape}")
+            return True
+        except FileNotFoundError:
+            logger.info(f"No vector matrix found at {path}, it will be built on first query")
+            return False
+        except Exception as e:
+            logger.warning(f"Discarding vector matrix cache at {path}: {e}")
+            self.index = None
+            return False
+    
+    def select_top_k(self, sims: np.ndarray, match_threshold: float, match_count: int) -> np.ndarray:
+        """Indices of the match_count highest scores above threshold, best first, in O(N)"""
+        above = np.flatnonzero(sims >= match_threshold)
+        match_count = max(match_count, 0)
+        if match_count < len(above):
+            above = above[np.argpartition(-sims[above], match_count)[:match_count]]
+        return above[np.argsort(-sims[above], kind='stable')]
+    
+    def batch_similarity_search(self, query_embedding: np.ndarray, 
                               documents: List[Dict], 
                               match_threshold: float = 0.5,
                               match_count: int = 2) -> List[Dict]:
@@ -67,8 +251,12 @@ class VectorSearchOptimizer:
         try:
             start_time = time.time()
             
-            # Convert query to numpy array once
-            query_array = np.array(query_embedding, dtype=np.float32)
+            # Convert query to a unit-length numpy array once
+            query_array = np.asarray(query_embedding, dtype=np.float32)
+            query_norm = np.linalg.norm(query_array)
+            if query_norm == 0:
+                return []
+            query_array = query_array / query_norm
             
             # Pre-filter documents with valid vectors
             valid_docs = []
@@ -79,35 +267,48 @@ class VectorSearchOptimizer:
             
             logger.info(f"Processing {len(valid_docs)} valid documents out of {len(documents)}")
             
-            # Batch process similarities
-            similarities = []
+            # Score every document with one matrix-vector product
+            index = self.build_matrix(valid_docs)
+            if index is not None:
+                # Score against one snapshot so rows and metadata always belong together
+                matrix, doc_index, _ = index
+                sims = cosine_scores(matrix, query_array)
+                top = self.select_top_k(sims, match_threshold, match_count)
+                top_matches = [dict(doc_index[i], similarity=float(sims[i])) for i in top]
+                
+                processing_time = time.time() - start_time
+                logger.info(f"Vector search completed in {processing_time:.3f}s, found {len(top_matches)} matches")
+                
+                return top_matches
+            
+            # Fallback: score documents one by one
+            scored_docs = []
+            scores = []
             for doc in valid_docs:
                 try:
                     # Parse vector with caching
-                    doc_vector = self.parse_vector(doc.get('vector', ''))
+                    doc_vector = self.parse_vector(doc.get('vector', ''), doc.get('id'))
                     
                     if len(doc_vector) == 0:
                         continue
                     
                     # Calculate similarity
-                    similarity = self.calculate_cosine_similarity_optimized(query_array, doc_vector)
-                    
-                    if similarity >= match_threshold:
-                        similarities.append({
-                            'id': doc.get('id'),
-                            'chunk': doc.get('chunk', ''),
-                            'original_data': doc.get('original_data', ''),
-                            'link': doc.get('link', ''),
-                            'similarity': similarity
-                        })
+                    scores.append(self.calculate_cosine_similarity_optimized(query_array, doc_vector))
+                    scored_docs.append(doc)
                         
                 except Exception as e:
                     logger.error(f"Error processing document {doc.get('id')}: {e}")
                     continue
             
-            # Sort and return top matches
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
-            top_matches = similarities[:match_count]
+            # Materialize result dicts only for the top matches
+            sims = np.array(scores)
+            top_matches = [{
+                'id': scored_docs[i].get('id'),
+                'chunk': scored_docs[i].get('chunk', ''),
+                'original_data': scored_docs[i].get('original_data', ''),
+                'link': scored_docs[i].get('link', ''),
+                'similarity': float(sims[i])
+            } for i in self.select_top_k(sims, match_threshold, match_count)]
             
             processing_time = time.time() - start_time
             logger.info(f"Vector search completed in {processing_time:.3f}s, found {len(top_matches)} matches")
@@ -123,6 +324,7 @@ class VectorSearchOptimizer:
         self.vector_cache.clear()
         self.similarity_cache.clear()
         self.documents_cache = None
+        self.index = None
         logger.info("Vector search cache cleared")
 
 # Global instance
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Vector Search Kernels
+Numba-compiled similarity kernels (falls back to NumPy when numba is not installed)
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    # Eagerly compiled for float32 inputs and cached on disk, so no JIT warmup on first request.
+    # Serial on purpose: request threads call it concurrently, and Numba's default parallel
+    # threading layer (workqueue) aborts on concurrent access.
+    @njit('float32[::1](float32[:, ::1], float32[::1])', fastmath=True, cache=True)
+    def _cosine_scores(matrix, query):
+        n, d = matrix.shape
+        out = np.empty(n, dtype=np.float32)
+        for i in range(n):
+            s = np.float32(0.0)
+            for j in range(d):
+                s += matrix[i, j] * query[j]
+            out[i] = s
+        return out
+
+def cosine_scores(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Dot product of every (unit-length) matrix row with a unit-length query"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    query = np.ascontiguousarray(query, dtype=np.float32)
+    
+    # The kernel does no bounds checking, e.g. after switching to a model with another dimension
+    if matrix.ndim != 2 or query.shape != (matrix.shape[1],):
+        raise ValueError(f"Query shape {query.shape} does not match matrix shape {matrix.shape}")
+    
+    if NUMBA_AVAILABLE:
+        return _cosine_scores(matrix, query)
+    return matrix @ query
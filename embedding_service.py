@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Embedding Service Module
+Micro-batches concurrent encode requests into a single SentenceTransformer call
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingService:
+    """Collects texts from concurrent requests and encodes them in batches"""
+    
+    def __init__(self, max_batch_size: int = 32, max_wait: float = 0.005):
+        """Initialize the service (the worker thread starts on first submit)"""
+        self.model = None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait  # Seconds to wait for more texts before encoding
+        self.timeout = 10  # Seconds a caller waits for its embedding
+        self.queue = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+    
+    def reset(self):
+        """Drop the queue and worker inherited from a parent process after a fork"""
+        self.queue = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+    
+    def set_model(self, model):
+        """Set the SentenceTransformer used for encoding"""
+        self.model = model
+    
+    def _ensure_worker(self):
+        """Start the worker thread if it is not running (e.g. first use or after a fork)"""
+        if self.worker is not None and self.worker.is_alive():
+            return
+        
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+                self.worker.start()
+    
+    def submit(self, text: str) -> Future:
+        """Queue a text for encoding and return a future for its embedding"""
+        if self.model is None:
+            raise RuntimeError('Embedding model not loaded')
+        
+        self._ensure_worker()
+        future = Future()
+        self.queue.put((text, future))
+        return future
+    
+    def encode(self, text: str):
+        """Encode a single text through the batching queue"""
+        future = self.submit(text)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drop the text from the queue so the worker does not encode it for nobody
+            future.cancel()
+            raise
+    
+    def _run(self):
+        """Worker loop: drain up to max_batch_size texts or max_wait seconds, then encode"""
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Skip requests whose callers already gave up
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            
+            try:
+                embeddings = self.model.encode(
+                    [text for text, _ in batch],
+                    batch_size=self.max_batch_size,
+                    convert_to_numpy=True
+                )
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+                
+                if len(batch) > 1:
+                    logger.info(f"Encoded batch of {len(batch)} texts")
+            except Exception as e:
+                logger.error(f"Failed to encode batch: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+# Global instance
+embedding_service = EmbeddingService()
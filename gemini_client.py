@@ -24,7 +24,10 @@ class GeminiClient:
         self.api_key = Config.GEMINI_API_KEY
         self.model = None
         self.is_initialized = False
-        self.executor = ThreadPoolExecutor(max_workers=3)  # Limit concurrent requests
+        self.max_workers = 8  # Limit concurrent requests
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
         self.timeout = 30  # 10 seconds timeout
         
         if self.api_key:
@@ -134,7 +137,10 @@ class GeminiClient:
         
         try:
             # Start async generation
+            with self._in_flight_lock:
+                self._in_flight += 1
             future = self.executor.submit(self._generate_response_sync, prompt)
+            future.add_done_callback(self._request_done)
             
             return {
                 'success': True,
@@ -160,7 +166,7 @@ class GeminiClient:
                 result = future.result()
             
             return {
-                'success': True,
+                'success': result.get('success', False),
                 'response': result.get('response'),
                 'error': result.get('error'),
                 'async': False
@@ -181,6 +187,16 @@ class GeminiClient:
                 'async': False
             }
     
+    def _request_done(self, future):
+        """Track completion (or cancellation) of an async request"""
+        with self._in_flight_lock:
+            self._in_flight -= 1
+    
+    def has_idle_worker(self) -> bool:
+        """Check if an executor slot is free for another async request"""
+        with self._in_flight_lock:
+            return self._in_flight < self.max_workers
+    
     def is_available(self) -> bool:
         """Check if Gemini AI is available"""
         return self.is_initialized and self.api_key is not None
@@ -190,6 +206,14 @@ class GeminiClient:
         self.timeout = timeout
         logger.info(f"Timeout set to {timeout}s")
     
+    def reinitialize(self):
+        """Re-create the executor and Gemini connection (e.g. in a forked worker process)"""
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        if self.api_key:
+            self._initialize_gemini()
+    
     def shutdown(self):
         """Shutdown the executor"""
         self.executor.shutdown(wait=True)
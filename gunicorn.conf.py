@@ -0,0 +1,25 @@
+"""
+Gunicorn configuration
+Preloads the app so the embedding model and vector matrix are shared copy-on-write across workers
+"""
+
+import os
+from config import Config
+
+bind = f"{Config.API_HOST}:{Config.API_PORT}"
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+# Threaded workers serve concurrent requests in one process, which the embedding micro-batcher needs
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+# CUDA cannot be used in a forked child, so a GPU model is loaded by each worker instead
+preload_app = not (Config.EMBEDDING_DEVICE or '').startswith('cuda')
+
+def post_fork(server, worker):
+    """Re-create network clients and threads that must not be shared across a fork"""
+    from database.supabase_client import supabase_manager
+    from embedding_service import embedding_service
+    from gemini_client import gemini_client
+    
+    supabase_manager.reconnect()
+    gemini_client.reinitialize()
+    embedding_service.reset()
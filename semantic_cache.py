@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Semantic Cache Module
+Caches AI responses by question embedding so near-duplicate questions skip Gemini
+"""
+
+import numpy as np
+import logging
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """In-memory cache of responses keyed by normalized question embeddings"""
+    
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, max_size: int = 1000):
+        """Initialize an empty cache"""
+        self.threshold = threshold  # Minimum cosine similarity for a hit
+        self.ttl = ttl  # Seconds before an entry expires
+        self.max_size = max_size  # Least recently used entries are evicted beyond this
+        self.embeddings = None  # (M, d) float32 matrix of normalized question embeddings
+        self.responses = []
+        self.keys = []  # Request parameters the response was produced with
+        self.created_at = []
+        self.last_used = []
+        self.lock = threading.Lock()
+    
+    def _normalize(self, embedding) -> np.ndarray:
+        """Return the embedding as a unit-length float32 vector (None if zero)"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+    
+    def _remove(self, indices):
+        """Drop entries at the given indices"""
+        keep = np.ones(len(self.responses), dtype=bool)
+        keep[indices] = False
+        self.embeddings = self.embeddings[keep]
+        self.responses = [r for r, k in zip(self.responses, keep) if k]
+        self.keys = [p for p, k in zip(self.keys, keep) if k]
+        self.created_at = [t for t, k in zip(self.created_at, keep) if k]
+        self.last_used = [t for t, k in zip(self.last_used, keep) if k]
+    
+    def _evict_expired(self, now: float):
+        """Drop entries older than the TTL"""
+        expired = [i for i, t in enumerate(self.created_at) if now - t > self.ttl]
+        if expired:
+            self._remove(expired)
+    
+    def get(self, embedding, key=None):
+        """Return the cached response for a similar question asked with the same key, or None on miss"""
+        query = self._normalize(embedding)
+        if query is None:
+            return None
+        
+        with self.lock:
+            now = time.time()
+            self._evict_expired(now)
+            
+            if not self.responses or self.embeddings.shape[1] != query.shape[0]:
+                return None
+            
+            sims = self.embeddings @ query
+            sims[[i for i, k in enumerate(self.keys) if k != key]] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            
+            self.last_used[best] = now
+            logger.info(f"Semantic cache hit (similarity {sims[best]:.3f})")
+            return self.responses[best]
+    
+    def put(self, embedding, response, key=None):
+        """Store a response for the given question embedding and key"""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        
+        with self.lock:
+            now = time.time()
+            self._evict_expired(now)
+            
+            if self.responses and self.embeddings.shape[1] != vector.shape[0]:
+                self._clear_entries()
+            
+            if len(self.responses) >= self.max_size:
+                self._remove([int(np.argmin(self.last_used))])
+            
+            row = vector[np.newaxis, :]
+            self.embeddings = row if not self.responses else np.vstack([self.embeddings, row])
+            self.responses.append(response)
+            self.keys.append(key)
+            self.created_at.append(now)
+            self.last_used.append(now)
+    
+    def _clear_entries(self):
+        """Clear all entries (caller must hold the lock)"""
+        self.embeddings = None
+        self.responses = []
+        self.keys = []
+        self.created_at = []
+        self.last_used = []
+    
+    def clear(self):
+        """Clear all entries"""
+        with self.lock:
+            self._clear_entries()
+        logger.info("Semantic cache cleared")
+
+# Global instance
+semantic_cache = SemanticCache(
+    threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+    ttl=Config.SEMANTIC_CACHE_TTL,
+    max_size=Config.SEMANTIC_CACHE_MAX_SIZE
+)